@@ -1,17 +1,25 @@
 #!/usr/bin/env python3
 
-import importlib.machinery
-import importlib.util
 import os
-import re
-import subprocess
+import signal
 import sys
 import types
 
 from typing import *
 
+if TYPE_CHECKING:
+  import importlib.machinery
+  import subprocess
+
 
 ROOT = os.path.abspath(os.path.dirname(__file__))
+_JOIN = os.path.join(ROOT, "")
+_PARALLEL_SCAN_MIN = 512
+
+# Python ignores these, and ignored signals survive exec()
+_RESTORE_SIGNALS = tuple(
+  getattr(signal, name) for name in ("SIGPIPE", "SIGXFSZ") if hasattr(signal, name)
+)
 
 
 class ScriptProtocol(Protocol):
@@ -22,12 +30,25 @@ class ScriptProtocol(Protocol):
 
 
 class Script:
+  _python3: bool | None = None
+
   def __init__(self, name: str):
-    self.name = os.path.basename(name)
-    self.path = os.path.abspath(os.path.join(ROOT, name))
+    if os.sep not in name and ".." not in name:
+      self.name = name
+      self.path = _JOIN + name
+    else:
+      self.name = os.path.basename(name)
+      self.path = os.path.abspath(os.path.join(ROOT, name))
     if not os.path.isfile(self.path):
       raise ModuleNotFoundError("no script named '{self.name}'")
 
+  @classmethod
+  def _from_entry(cls, entry: os.DirEntry) -> Self:
+    self = cls.__new__(cls)
+    self.name = entry.name
+    self.path = entry.path
+    return self
+
   def __repr__(self):
     return f"<Script name={self.name!r} path={self.path!r}>"
 
@@ -35,23 +56,32 @@ class Script:
     if not module_name:
       module_name = os.path.basename(self.name).replace("-", "_")
 
+    existing = sys.modules.get(module_name)
+    if existing is not None and getattr(existing, "__file__", None) == self.path:
+      return cast(ScriptProtocol, existing)
+
     module: ScriptProtocol
 
     if self.is_python3():
+      import importlib.machinery
+      import importlib.util
+
+      loader = importlib.machinery.SourceFileLoader(module_name, self.path)
+      spec = importlib.util.spec_from_loader(module_name, loader)
+      if not spec:
+        raise ImportError(f"BUG while loading '{self.name}'")
+      module = importlib.util.module_from_spec(spec)
+      code = self.get_code(loader)
+
       dont_write_bytecode = sys.dont_write_bytecode
       sys.dont_write_bytecode = True
       try:
-        loader = importlib.machinery.SourceFileLoader(module_name, self.path)
-        spec = importlib.util.spec_from_loader(module_name, loader)
-        if not spec:
-          raise ImportError(f"BUG while loading '{self.name}'")
-        module = importlib.util.module_from_spec(spec)
-        loader.exec_module(module)
+        exec(code, module.__dict__)
       finally:
         sys.dont_write_bytecode = dont_write_bytecode
       module.__file__ = module.__file__ or self.path
       if callable(getattr(module, "main", None)):
-        setattr(module, "main", PythonMainWrapper(module.__file__, module.main))
+        setattr(module, "main", MainWrapper(module.__file__, module.main))
     else:
       module = types.ModuleType(module_name)
       module.__file__ = self.path
@@ -61,41 +91,127 @@ class Script:
       sys.modules[module_name] = cast(types.ModuleType, module)
     return module
 
+  def get_code(self, loader: "importlib.machinery.SourceFileLoader") -> types.CodeType:
+    # Scripts have no .py suffix, so the import system won't cache their
+    # bytecode for us; keep our own cache under $XDG_CACHE_HOME instead.
+    import importlib.util
+    import marshal
+
+    cache_path = self.cache_path
+    if not cache_path:
+      return loader.source_to_code(loader.get_data(self.path), self.path)
+
+    st = os.stat(self.path)
+    header = b"".join((
+      importlib.util.MAGIC_NUMBER,
+      (0).to_bytes(4, "little"),
+      (int(st.st_mtime) & 0xFFFFFFFF).to_bytes(4, "little"),
+      (st.st_size & 0xFFFFFFFF).to_bytes(4, "little"),
+    ))
+
+    try:
+      with open(cache_path, "rb") as f:
+        data = f.read()
+      if data[:16] == header:
+        return marshal.loads(data[16:])
+    except (OSError, EOFError, ValueError, TypeError):
+      pass
+
+    code = loader.source_to_code(loader.get_data(self.path), self.path)
+
+    if not sys.dont_write_bytecode:
+      tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+      try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+          f.write(header + marshal.dumps(code))
+        os.replace(tmp_path, cache_path)
+      except OSError:
+        try:
+          os.unlink(tmp_path)
+        except OSError:
+          pass
+
+    return code
+
+  @property
+  def cache_path(self) -> str | None:
+    cache_tag = sys.implementation.cache_tag
+    if cache_tag is None:
+      return None
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(
+      cache_home, "s-zeid-bin", self.path.lstrip(os.sep) + f".{cache_tag}.pyc",
+    )
+
   def is_python3(self) -> bool:
-    with open(self.path, "rb") as f:
-      shebang = f.readline()
-      if shebang.startswith(b"#!"):
-        if b"python" in shebang and not b"python2" in shebang:
-          return True
-    return False
+    if self._python3 is None:
+      self._python3 = _is_python3(self.path)
+    return self._python3
 
   @classmethod
-  def find_all(cls) -> list[Self]:
-    return [
-      cls(filename)
-      for filename in sorted(os.listdir(ROOT))
-      if "." not in filename and not os.path.isdir(os.path.join(ROOT, filename))
-    ]
+  def find_all(cls, *, sort: bool = True) -> list[Self]:
+    with os.scandir(ROOT) as it:
+      entries = [entry for entry in it if "." not in entry.name and entry.is_file()]
+    if sort:
+      entries.sort(key=lambda entry: entry.name)
+    return [cls._from_entry(entry) for entry in entries]
 
   @classmethod
   def find_no_main(cls) -> list[Self]:
-    result = []
+    scripts = cls.find_all(sort=False)
+
+    # threads only pay off on cold caches or network filesystems
+    if len(scripts) < _PARALLEL_SCAN_MIN:
+      return [script for script in map(_check_no_main, scripts) if script is not None]
+
+    import concurrent.futures
+
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+      results = list(executor.map(_check_no_main, scripts))
+    return [script for script in results if script is not None]
+
+
+def _is_python3(path: str) -> bool:
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    head = os.read(fd, 128)
+  finally:
+    os.close(fd)
+  return _is_python3_shebang(head.split(b"\n", 1)[0])
+
 
-    for script in cls.find_all():
-      if not script.is_python3():
-        continue
-      with open(script.path, "rb") as f:
-        if not re.search(rb"^def main\(argv", f.read(), re.MULTILINE):
-          result += [script]
+def _is_python3_shebang(shebang: bytes) -> bool:
+  if shebang.startswith(b"#!"):
+    if b"python" in shebang and not b"python2" in shebang:
+      return True
+  return False
 
-    return result
+
+def _check_no_main(script: Script) -> Script | None:
+  with open(script.path, "rb", buffering=65536) as f:
+    if not _is_python3_shebang(f.readline(128)):
+      return None
+    for line in f:
+      if line.startswith(b"def main(argv"):
+        return None
+  return script
+
+
+def _spawn_wait(executable: str, argv: list[str]) -> int:
+  pid = os.posix_spawn(executable, argv, os.environ, setsigdef=_RESTORE_SIGNALS)
+  _, status = os.waitpid(pid, 0)
+  return os.waitstatus_to_exitcode(status)
 
 
 class MainWrapper:
   real_main: ScriptProtocol.MainProtocol
 
-  def __init__(self, filename: str):
+  def __init__(self, filename: str, real_main: ScriptProtocol.MainProtocol | None = None):
     self.filename = filename
+    if real_main is not None:
+      self.real_main = real_main
 
   def __call__(self, argv: list[str] | None = None, *args, **kwargs) -> int:
     result = self.real_main(self.fix_argv(argv, self.filename), *args, **kwargs)
@@ -114,25 +230,39 @@ class MainWrapper:
     return argv
 
 
-class PythonMainWrapper(MainWrapper):
-  def __init__(self, filename: str, real_main: ScriptProtocol.MainProtocol):
-    self.filename = filename
-    self.real_main = real_main
-
-
 class ShellMainWrapper(MainWrapper):
-  def __init__(self, filename: str):
-    super().__init__(filename)
-
   def real_main(self, argv: list[str], *args, **kwargs) -> int:
-    return self.Popen(argv).wait()
+    if not hasattr(os, "posix_spawn"):
+      return self.Popen(argv).wait()
+    return _spawn_wait(self.filename, argv)
+
+  def exec(self, argv: list[str] | None = None) -> NoReturn:
+    for signum in _RESTORE_SIGNALS:
+      signal.signal(signum, signal.SIG_DFL)
+    os.execv(self.filename, self.fix_argv(argv, self.filename))
+
+  def Popen(self, argv: list[str], *popen_args, **popen_kwargs) -> "subprocess.Popen":
+    import subprocess
 
-  def Popen(self, argv: list[str], *popen_args, **popen_kwargs) -> subprocess.Popen:
     popen_kwargs = popen_kwargs.copy()
     popen_kwargs["executable"] = self.filename
     return subprocess.Popen(argv, *popen_args, **popen_kwargs)
 
 
+_previous_sigint_handler: Any = None
+
+
+def _exit_on_sigint(signum: int, frame: types.FrameType | None) -> NoReturn:
+  os._exit(128 + signum)
+
+
+def _install_sigint_handler() -> None:
+  # leave SIGINT alone if it was ignored or handled by whoever started us
+  global _previous_sigint_handler
+  if signal.getsignal(signal.SIGINT) is signal.default_int_handler:
+    _previous_sigint_handler = signal.signal(signal.SIGINT, _exit_on_sigint)
+
+
 def main(argv: list[str]) -> int:
   prog = os.path.basename(argv[0])
   prog = prog if prog != "__main__.py" else __package__ or __name__
@@ -142,14 +272,25 @@ def main(argv: list[str]) -> int:
     return 2
 
   if argv[1] == "--no-main":
-    for script in Script.find_no_main():
+    for script in sorted(Script.find_no_main(), key=lambda script: script.name):
       print(script.name)
     return 0
 
-  return Script(argv[1]).load().main(argv[1:])
+  script = Script(argv[1])
+  if not script.is_python3():
+    # nothing left for us to do after the script exits, so replace ourselves
+    ShellMainWrapper(script.path).exec(argv[1:])
+
+  # Python scripts may catch KeyboardInterrupt to clean up after themselves
+  if signal.getsignal(signal.SIGINT) is _exit_on_sigint:
+    signal.signal(signal.SIGINT, _previous_sigint_handler)
+
+  return script.load().main(argv[1:])
 
 
 if __name__ == "__main__":
+  # exit immediately on ^C while scanning for --no-main
+  _install_sigint_handler()
   try:
     sys.exit(main(sys.argv))
   except KeyboardInterrupt:
@@ -1,9 +1,11 @@
 import sys
 
-from . import main
+from . import _install_sigint_handler, main
 
 
 if __name__ == "__main__":
+  # exit immediately on ^C while scanning for --no-main
+  _install_sigint_handler()
   try:
     sys.exit(main(sys.argv))
   except KeyboardInterrupt: